@@ -11,21 +11,61 @@ KlicStudio MCP 服务器
 """
 
 import httpx
+import orjson
 import os
+import asyncio
 import base64
+import codecs
+import copy
+import logging
+import random
+import time
 import mimetypes
 import argparse
-from typing import Optional, List, Union, Dict, Any, Literal
+import sys
+from dataclasses import dataclass
+from typing import Optional, List, Union, Dict, Any, Literal, AsyncIterator, BinaryIO
 
 from mcp.server.fastmcp import FastMCP, Context
 
+log = logging.getLogger("klicstudio_mcp")
+
 # ===== 全局配置 =====
 KLICSTUDIO_BASE_URL: str = "http://127.0.0.1:8888"
+# 同时发往 KlicStudio 的最大请求数，防止突发的工具调用压垮服务
+KLICSTUDIO_MAX_PARALLEL: int = 16
+
+# 共享的 HTTP 客户端，复用连接池，避免每次调用都重新建立 TCP/TLS 连接
+_client: Optional[httpx.AsyncClient] = None           # 绑定 KLICSTUDIO_BASE_URL
+_external_client: Optional[httpx.AsyncClient] = None  # 用于任意完整 URL 的下载
+_request_semaphore = asyncio.Semaphore(KLICSTUDIO_MAX_PARALLEL)
+
+# 瞬时错误的重试策略：指数退避 + 随机抖动，仅用于幂等请求
+_RETRY_ATTEMPTS: int = 4
+_RETRY_INITIAL_DELAY: float = 0.2
+_RETRY_MAX_DELAY: float = 3.0
+_RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ReadTimeout, httpx.RemoteProtocolError)
+_RETRYABLE_STATUS_CODES = {502, 503, 504}
+# 整体覆盖写入、重复提交无副作用的 POST 接口；上传文件和创建任务不在此列，避免重复提交
+_IDEMPOTENT_POST_ENDPOINTS = {"/api/config"}
+
+# 系统配置缓存：(获取时间, 响应)，写入配置或切换服务地址后失效。
+# TTL 内直接返回缓存；过期后携带 ETag 条件请求，服务端返回 304 时继续沿用缓存
+_CONFIG_TTL: float = 10.0
+_config_cache: Optional[tuple[float, dict]] = None
+_config_etag: Optional[str] = None
 
 # 创建 FastMCP 服务器实例
 mcp = FastMCP("KlicStudioConnector")
 
 # ===== 类型定义 =====
+@dataclass(slots=True)
+class KlicResponse:
+    """MCP 工具在本地构造的返回结果，字段与 KlicStudio API 的响应格式一致"""
+    error: int
+    msg: str
+    data: Any = None
+
 SourceLanguage = Literal["zh_cn", "en", "ja", "tr", "de", "ko", "ru"]
 
 TranslationLanguage = Literal[
@@ -36,35 +76,211 @@ TranslationLanguage = Literal[
     "sk", "bs", "mk", "sl", "bg", "lv", "lt", "et", "mt", "sq"
 ]
 
+# 常见媒体文件扩展名对应的 MIME 类型，命中时无需查询 mimetypes
+_MIME_BY_EXT: Dict[str, str] = {
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".avi": "video/x-msvideo",
+    ".mkv": "video/x-matroska",
+    ".webm": "video/webm",
+    ".flv": "video/x-flv",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".aac": "audio/aac",
+    ".m4a": "audio/mp4",
+    ".flac": "audio/flac",
+    ".ogg": "audio/ogg",
+}
+
+# KlicStudio 中开关类参数的取值：1 = 启用，2 = 不启用
+_BOOL_FLAG: Dict[bool, int] = {True: 1, False: 2}
+
 # ===== 辅助函数 =====
+def _get_client() -> httpx.AsyncClient:
+    """获取（首次调用时创建）指向 KlicStudio 服务的共享 AsyncClient"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=KLICSTUDIO_BASE_URL,
+            timeout=httpx.Timeout(120.0),
+            # 连接池上限与并发信号量保持一致
+            limits=httpx.Limits(
+                max_keepalive_connections=KLICSTUDIO_MAX_PARALLEL,
+                max_connections=KLICSTUDIO_MAX_PARALLEL,
+            ),
+            # https 地址通过 ALPN 协商 HTTP/2，多个请求复用同一连接；
+            # http 地址（如默认的本地服务）仍使用 HTTP/1.1 keep-alive
+            http2=True,
+        )
+    return _client
+
+def _get_external_client() -> httpx.AsyncClient:
+    """获取（首次调用时创建）用于访问完整外部 URL 的共享 AsyncClient"""
+    global _external_client
+    if _external_client is None:
+        _external_client = httpx.AsyncClient(timeout=60.0)
+    return _external_client
+
+def _klicstudio_url(path: str) -> str:
+    """将 KlicStudio 上的相对路径拼接为完整 URL，保留 BASE URL 中的路径前缀"""
+    # 共享客户端的 base_url 已规范化为以 '/' 结尾，去掉 path 开头的 '/' 即可按相对路径拼接
+    return str(_get_client().base_url.join(path.lstrip('/')))
+
+async def _close_clients() -> None:
+    """关闭所有共享的 HTTP 客户端"""
+    global _client, _external_client
+    for client in (_client, _external_client):
+        if client is not None:
+            await client.aclose()
+    _client = None
+    _external_client = None
+
+async def _download_text(url: str, encoding: str) -> tuple[str, str, int]:
+    """边下载边增量解码文本，返回 (文本内容, MIME 类型, 下载字节数)"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+    async with _get_external_client().stream("GET", url) as response:
+        response.raise_for_status()
+        chunks = [decoder.decode(chunk) async for chunk in response.aiter_bytes(65536)]
+        chunks.append(decoder.decode(b"", final=True))
+        mime_type = response.headers.get("content-type", "text/plain")
+        return "".join(chunks), mime_type, response.num_bytes_downloaded
+
+def _invalidate_config_cache() -> None:
+    """清除缓存的系统配置及其 ETag"""
+    global _config_cache, _config_etag
+    _config_cache = None
+    _config_etag = None
+
+def _multipart_file_body(
+    f: BinaryIO, file_name: str, mime_type: str, file_size: int
+) -> tuple[AsyncIterator[bytes], Dict[str, str]]:
+    """
+    构造单个 "file" 字段的 multipart/form-data 流式请求体，返回 (请求体, 请求头)。
+    文件按 64 KiB 分块在线程中读取，上传大文件时不会阻塞事件循环。
+    """
+    boundary = os.urandom(16).hex()
+    # 与 httpx 一致，按 HTML5 规则转义文件名中的引号、反斜杠和换行
+    quoted_name = (
+        file_name.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+    )
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{quoted_name}"\r\n'
+        f"Content-Type: {mime_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    async def body() -> AsyncIterator[bytes]:
+        yield head
+        while chunk := await asyncio.to_thread(f.read, 1 << 16):
+            yield chunk
+        yield tail
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + file_size + len(tail)),
+    }
+    return body(), headers
+
+async def _fetch_system_config() -> dict:
+    """获取 KlicStudio 系统配置响应，_CONFIG_TTL 秒内的重复调用直接返回缓存副本"""
+    global _config_cache, _config_etag
+    cached = _config_cache
+    if cached is not None and time.monotonic() - cached[0] < _CONFIG_TTL:
+        return copy.deepcopy(cached[1])
+
+    headers = {"If-None-Match": _config_etag} if cached is not None and _config_etag else {}
+    response = await _klicstudio_request("GET", "/api/config", headers=headers)
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        if cached is not None and _config_cache is cached:
+            # 服务端配置未变化，沿用缓存内容并刷新有效期
+            _config_cache = (time.monotonic(), cached[1])
+            return copy.deepcopy(cached[1])
+        # 请求期间缓存已失效（例如配置被更新），不带条件头重新获取
+        response = await _klicstudio_request("GET", "/api/config")
+
+    klicstudio_response = orjson.loads(response.content)
+    if klicstudio_response.get("error") == 0:
+        _config_cache = (time.monotonic(), klicstudio_response)
+        _config_etag = response.headers.get("ETag")
+        return copy.deepcopy(klicstudio_response)
+    return klicstudio_response
+
+async def _klicstudio_file_exists(endpoint: str) -> Optional[bool]:
+    """
+    探测 KlicStudio 上的文件是否存在：True 存在，False 不存在，None 无法确定。
+    使用只请求首字节的 GET 而非 HEAD，仅注册了 GET 的文件路由也能正确响应；
+    不读取响应体，服务端忽略 Range 返回完整文件时也不会下载整个文件。
+    """
+    try:
+        async with _request_semaphore:
+            async with _get_client().stream("GET", endpoint, headers={"Range": "bytes=0-0"}) as response:
+                status_code = response.status_code
+    except httpx.HTTPError as e:
+        log.warning("探测 KlicStudio 文件失败 %s: %s", endpoint, e)
+        return None
+    # 416 表示文件存在但为空，Range 无法满足
+    if status_code in (200, 206, 416):
+        return True
+    if status_code == 404:
+        return False
+    return None
+
+async def _retry_sleep(method: str, url: str, attempt: int, error: Exception) -> None:
+    """按指数退避加随机抖动等待下一次重试"""
+    delay = min(
+        _RETRY_MAX_DELAY,
+        _RETRY_INITIAL_DELAY * 2 ** (attempt - 1) + random.uniform(0, _RETRY_INITIAL_DELAY),
+    )
+    log.warning("KlicStudio API 请求失败 (%s %s: %r)，%.2fs 后进行第 %d 次重试", method, url, error, delay, attempt)
+    await asyncio.sleep(delay)
+
 async def _klicstudio_request(method: str, endpoint: str, **kwargs) -> httpx.Response:
-    """统一处理对 KlicStudio API 的请求"""
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        url = f"{KLICSTUDIO_BASE_URL}{endpoint}"
-        
-        log_kwargs = {k: v for k, v in kwargs.items() if k != "files"} 
-        print(f"向 KlicStudio 发起请求: {method} {url} with {log_kwargs}")
+    """统一处理对 KlicStudio API 的请求，幂等请求遇到瞬时错误时自动退避重试"""
+    client = _get_client()
+    method = method.upper()
+    url = f"{KLICSTUDIO_BASE_URL}{endpoint}"
 
-        try:
-            if method.upper() == "GET":
-                response = await client.get(url, **kwargs)
-            elif method.upper() == "POST":
-                response = await client.post(url, **kwargs)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
+    if log.isEnabledFor(logging.DEBUG): # 仅在需要输出时才构造日志参数
+        log_kwargs = {k: v for k, v in kwargs.items() if k != "files"}
+        log.debug("向 KlicStudio 发起请求: %s %s with %s", method, url, log_kwargs)
 
-            response.raise_for_status()
+    retryable = method in ("GET", "HEAD") or (method == "POST" and endpoint in _IDEMPOTENT_POST_ENDPOINTS)
+    attempts = _RETRY_ATTEMPTS if retryable else 1
+
+    for attempt in range(1, attempts + 1):
+        try:
+            async with _request_semaphore:
+                response = await client.request(method, endpoint, **kwargs)
+            # 304 是条件请求的正常结果，由调用方处理
+            if response.status_code != httpx.codes.NOT_MODIFIED:
+                response.raise_for_status()
             return response
         except httpx.HTTPStatusError as e:
-            print(f"KlicStudio API HTTP Error for {method} {url}: {e.response.status_code} - {e.response.text}")
+            if attempt < attempts and e.response.status_code in _RETRYABLE_STATUS_CODES:
+                await _retry_sleep(method, url, attempt, e)
+                continue
+            log.error("KlicStudio API HTTP Error for %s %s: %s - %s", method, url, e.response.status_code, e.response.text)
             raise
         except httpx.RequestError as e:
-            print(f"KlicStudio API Request Error for {method} {url}: {str(e)}")
+            if attempt < attempts and isinstance(e, _RETRYABLE_ERRORS):
+                await _retry_sleep(method, url, attempt, e)
+                continue
+            log.error("KlicStudio API Request Error for %s %s: %s", method, url, e)
             raise
         except Exception as e:
-            print(f"Unexpected error during KlicStudio API call for {method} {url}: {str(e)}")
+            log.error("Unexpected error during KlicStudio API call for %s %s: %s", method, url, e)
             raise
 
+async def _post_json(endpoint: str, payload: Any) -> httpx.Response:
+    """使用 orjson 序列化请求体，向 KlicStudio 发送 JSON POST 请求"""
+    return await _klicstudio_request(
+        "POST",
+        endpoint,
+        content=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"},
+    )
+
 # --- MCP 工具集合 ---
 
 # ===== 1. 配置管理工具 =====
@@ -75,13 +291,13 @@ async def get_klicstudio_base_url(ctx: Context) -> dict:
     """
     global KLICSTUDIO_BASE_URL
     ctx.info(f"获取当前 KlicStudio BASE URL: {KLICSTUDIO_BASE_URL}")
-    return {
-        "error": 0,
-        "msg": "当前配置获取成功",
-        "data": {
+    return KlicResponse(
+        error=0,
+        msg="当前配置获取成功",
+        data={
             "klicstudio_base_url": KLICSTUDIO_BASE_URL
-        }
-    }
+        },
+    )
 
 @mcp.tool()
 async def set_klicstudio_base_url(ctx: Context, new_url: str) -> dict:
@@ -93,25 +309,31 @@ async def set_klicstudio_base_url(ctx: Context, new_url: str) -> dict:
         new_url: 新的 KlicStudio 服务 BASE URL (例如 "http://localhost:8889" 或 "http://remote.klicstudio.server").
                  请确保 URL 格式正确且服务可达。
     """
-    global KLICSTUDIO_BASE_URL
+    global KLICSTUDIO_BASE_URL, _client
     previous_url = KLICSTUDIO_BASE_URL
     
     if not (new_url.startswith("http://") or new_url.startswith("https://")):
         msg = "设置失败：URL 格式不正确，应以 http:// 或 https:// 开头。"
         ctx.error(msg)
-        return {"error": 1, "msg": msg, "data": {"previous_url": previous_url}}
+        return KlicResponse(error=1, msg=msg, data={"previous_url": previous_url})
 
     KLICSTUDIO_BASE_URL = new_url.rstrip('/') # 存储时移除末尾斜杠
+    if KLICSTUDIO_BASE_URL != previous_url:
+        _invalidate_config_cache()
+        if _client is not None:
+            # 共享客户端绑定了旧的 base_url，关闭后在下次请求时按新地址重建
+            old_client, _client = _client, None
+            await old_client.aclose()
     msg = f"KlicStudio BASE URL 已从 '{previous_url}' 更新为 '{KLICSTUDIO_BASE_URL}'。"
     ctx.info(msg)
-    return {
-        "error": 0,
-        "msg": msg,
-        "data": {
+    return KlicResponse(
+        error=0,
+        msg=msg,
+        data={
             "new_klicstudio_base_url": KLICSTUDIO_BASE_URL,
             "previous_klicstudio_base_url": previous_url
-        }
-    }
+        },
+    )
 
 @mcp.tool()
 async def get_klicstudio_system_config(ctx: Context) -> dict:
@@ -120,13 +342,18 @@ async def get_klicstudio_system_config(ctx: Context) -> dict:
     """
     try:
         ctx.info("获取 KlicStudio 系统配置...")
-        response = await _klicstudio_request("GET", "/api/config")
-        klicstudio_response = response.json()
+        klicstudio_response = await _fetch_system_config()
         ctx.info("KlicStudio 系统配置获取成功")
         return klicstudio_response
     except Exception as e:
+        if _config_cache is not None:
+            # 请求失败时退回到最近一次成功获取的配置，并标记为过期
+            ctx.warning(f"获取 KlicStudio 系统配置失败，返回缓存的配置: {str(e)}")
+            stale_response = copy.deepcopy(_config_cache[1])
+            stale_response["stale"] = True
+            return stale_response
         ctx.error(f"获取 KlicStudio 系统配置失败: {str(e)}")
-        return {"error": 1, "msg": f"获取系统配置失败: {str(e)}", "data": None}
+        return KlicResponse(error=1, msg=f"获取系统配置失败: {str(e)}")
 
 @mcp.tool()
 async def update_klicstudio_system_config(ctx: Context, config_data: dict) -> dict:
@@ -176,10 +403,11 @@ async def update_klicstudio_system_config(ctx: Context, config_data: dict) -> di
         ctx.info("准备更新 KlicStudio 系统配置...")
         ctx.info(f"配置数据: {config_data}")
         
-        response = await _klicstudio_request("POST", "/api/config", json=config_data)
-        klicstudio_response = response.json()
+        response = await _post_json("/api/config", config_data)
+        klicstudio_response = orjson.loads(response.content)
         
         if klicstudio_response.get("error") == 0:
+            _invalidate_config_cache()
             ctx.info("KlicStudio 系统配置更新成功")
         else:
             ctx.error(f"KlicStudio 系统配置更新失败: {klicstudio_response.get('msg', '未知错误')}")
@@ -187,7 +415,7 @@ async def update_klicstudio_system_config(ctx: Context, config_data: dict) -> di
         return klicstudio_response
     except Exception as e:
         ctx.error(f"更新 KlicStudio 系统配置失败: {str(e)}")
-        return {"error": 1, "msg": f"更新系统配置失败: {str(e)}", "data": None}
+        return KlicResponse(error=1, msg=f"更新系统配置失败: {str(e)}")
 
 @mcp.tool()
 async def update_klicstudio_llm_config(
@@ -198,6 +426,8 @@ async def update_klicstudio_llm_config(
 ) -> dict:
     """
     快速更新 KlicStudio 的 LLM 配置。这是一个便捷方法，只更新 LLM 相关配置。
+    /api/config 只接受完整配置，因此会基于当前完整配置修改 LLM 部分后整体提交；
+    若短时间内已获取过配置则直接复用缓存，仅需一次 POST 请求。
     
     Args:
         base_url: LLM API 的基础 URL
@@ -207,8 +437,8 @@ async def update_klicstudio_llm_config(
         包含更新结果的字典
     """
     try:
-        # 先获取当前配置
-        current_config_response = await get_klicstudio_system_config(ctx)
+        # 先获取当前配置（缓存未过期时不会发起请求）
+        current_config_response = await _fetch_system_config()
         if current_config_response.get("error") != 0:
             return current_config_response
             
@@ -223,7 +453,7 @@ async def update_klicstudio_llm_config(
         
     except Exception as e:
         ctx.error(f"快速更新 LLM 配置失败: {str(e)}")
-        return {"error": 1, "msg": f"更新 LLM 配置失败: {str(e)}", "data": None}
+        return KlicResponse(error=1, msg=f"更新 LLM 配置失败: {str(e)}")
 
 # ===== 2. 文件管理工具 =====
 @mcp.tool()
@@ -239,28 +469,27 @@ async def upload_file_to_klicstudio(ctx: Context, server_accessible_file_path: s
         一个包含 KlicStudio 服务上文件路径的字典，或错误信息。
     """
     try:
-        if not os.path.exists(server_accessible_file_path):
-            return {"error": 1, "msg": f"文件未找到: {server_accessible_file_path}", "data": None}
+        # 文件系统调用（包括上传时的分块读取）都在线程中执行
+        if not await asyncio.to_thread(os.path.exists, server_accessible_file_path):
+            return KlicResponse(error=1, msg=f"文件未找到: {server_accessible_file_path}")
         
         file_name = os.path.basename(server_accessible_file_path)
-        
-        with open(server_accessible_file_path, "rb") as f:
-            file_content = f.read()
+        file_size = await asyncio.to_thread(os.path.getsize, server_accessible_file_path)
             
-        mime_type, _ = mimetypes.guess_type(server_accessible_file_path)
-        if mime_type is None:
-            if file_name.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
-                mime_type = 'video/mp4' # 常用视频MIME
-            elif file_name.lower().endswith(('.mp3', '.wav', '.aac', '.m4a')):
-                mime_type = 'audio/mpeg' # 常用音频MIME
-            else:
-                mime_type = 'application/octet-stream'
+        ext = os.path.splitext(file_name)[1].lower()
+        mime_type = (
+            _MIME_BY_EXT.get(ext)
+            or mimetypes.guess_type(file_name, strict=False)[0]
+            or "application/octet-stream"
+        )
             
-        files_param = {"file": (file_name, file_content, mime_type)}
-        
-        ctx.info(f"准备上传文件: {file_name} (MIME: {mime_type}) 到 KlicStudio...")
-        response = await _klicstudio_request("POST", "/api/file", files=files_param)
-        klicstudio_response = response.json()
+        ctx.info(f"准备上传文件: {file_name} (MIME: {mime_type}, {file_size} bytes) 到 KlicStudio...")
+        # 流式发送 multipart 请求体，并根据文件大小预先给出 Content-Length，无需将整个文件读入内存
+        f = await asyncio.to_thread(open, server_accessible_file_path, "rb")
+        with f:
+            body, headers = _multipart_file_body(f, file_name, mime_type, file_size)
+            response = await _klicstudio_request("POST", "/api/file", content=body, headers=headers)
+        klicstudio_response = orjson.loads(response.content)
         ctx.info(f"KlicStudio 文件上传响应: {klicstudio_response}")
         if klicstudio_response.get("data") and isinstance(klicstudio_response["data"].get("file_path"), str):
             klicstudio_response["data"]["file_path"] = klicstudio_response["data"]["file_path"][0]
@@ -269,7 +498,7 @@ async def upload_file_to_klicstudio(ctx: Context, server_accessible_file_path: s
             
     except Exception as e:
         ctx.error(f"上传文件到 KlicStudio 失败: {str(e)}")
-        return {"error": 1, "msg": f"上传文件失败: {str(e)}", "data": None}
+        return KlicResponse(error=1, msg=f"上传文件失败: {str(e)}")
 
 # ===== 3. 字幕任务工具 =====
 @mcp.tool()
@@ -318,61 +547,51 @@ async def start_klicstudio_subtitle_task(
         一个包含任务 ID 的字典，或错误信息。
     """
     try:
-        payload: Dict[str, Any] = {
+        tts_enabled = _BOOL_FLAG[tts] == 1 # 只有当 tts 实际要发送为 1 (启用) 时，才发送 tts 相关子参数
+        raw_payload: Dict[str, Any] = {
             "url": media_url_on_klicstudio,
             "language": language,
-            "bilingual": 1 if bilingual else 2,
+            # 只有在需要翻译时，才考虑默认 origin_lang
+            "origin_lang": origin_lang or (language if target_lang else None),
+            "target_lang": target_lang or None,
+            "bilingual": _BOOL_FLAG[bilingual],
             "translation_subtitle_pos": translation_subtitle_pos,
-            "tts": 1 if tts else 2,
-            "modal_filter": 1 if modal_filter else 2,
+            "tts": _BOOL_FLAG[tts],
+            "tts_voice_code": tts_voice_code if tts_enabled else None,
+            "tts_voice_clone_src_file_url": (tts_voice_clone_src_file_url or None) if tts_enabled else None,
+            "modal_filter": _BOOL_FLAG[modal_filter],
             "embed_subtitle_video_type": embed_subtitle_video_type,
+            "vertical_major_title": vertical_major_title,
+            "vertical_minor_title": vertical_minor_title,
+            "replace": replace_words or None,
         }
-        if origin_lang:
-            payload["origin_lang"] = origin_lang
-        else:
-            if target_lang: # 只有在需要翻译时，才考虑默认origin_lang
-                 payload["origin_lang"] = language
+        # 未设置的可选参数不发送
+        payload = {k: v for k, v in raw_payload.items() if v is not None}
 
-        if target_lang:
-            payload["target_lang"] = target_lang
-        
-        if payload["tts"] == 1: # 只有当 tts 实际要发送为 1 (启用) 时，才处理 tts 相关子参数
-            if tts_voice_code is not None:
-                payload["tts_voice_code"] = tts_voice_code
-            if tts_voice_clone_src_file_url:
-                payload["tts_voice_clone_src_file_url"] = tts_voice_clone_src_file_url
-        
-        if vertical_major_title is not None:
-            payload["vertical_major_title"] = vertical_major_title
-        if vertical_minor_title is not None:
-            payload["vertical_minor_title"] = vertical_minor_title
-        if replace_words:
-            payload["replace"] = replace_words
-            
         ctx.info(f"向 KlicStudio 启动字幕任务，参数: {payload}")
-        response = await _klicstudio_request("POST", "/api/capability/subtitleTask", json=payload)
-        klicstudio_response = response.json()
+        response = await _post_json("/api/capability/subtitleTask", payload)
+        klicstudio_response = orjson.loads(response.content)
         ctx.info(f"KlicStudio 字幕任务启动响应: {klicstudio_response}")
         return klicstudio_response
     except Exception as e:
         ctx.error(f"启动 KlicStudio 字幕任务失败: {str(e)}")
-        return {"error": 1, "msg": f"启动字幕任务失败: {str(e)}", "data": None}
+        return KlicResponse(error=1, msg=f"启动字幕任务失败: {str(e)}")
 
 @mcp.tool()
 async def get_klicstudio_subtitle_task_details(ctx: Context, task_id: str) -> dict:
     """
     获取 KlicStudio 字幕任务的当前状态、进度和结果（如果已完成）。
-    如果任务完成且可能生成了嵌入字幕的视频，会尝试添加这些视频的潜在下载链接。
+    如果任务完成，会检查嵌入字幕的视频是否已生成，并添加其下载链接（确认不存在的视频不会列出，无法确认的会标注"可能存在"）。
 
     Args:
         task_id: 要查询的任务 ID。
     Returns:
-        一个包含任务详细信息的字典，包括状态、进度、字幕/语音下载链接，以及可能的嵌入字幕视频链接。
+        一个包含任务详细信息的字典，包括状态、进度、字幕/语音下载链接，以及嵌入字幕视频链接。
     """
     try:
         ctx.info(f"查询 KlicStudio 字幕任务详情，Task ID: {task_id}")
         response = await _klicstudio_request("GET", f"/api/capability/subtitleTask?taskId={task_id}")
-        klicstudio_response = response.json()
+        klicstudio_response = orjson.loads(response.content)
         
         # 修改响应中的数据，添加完整的下载链接
         if klicstudio_response.get("error") == 0 and "data" in klicstudio_response:
@@ -382,43 +601,43 @@ async def get_klicstudio_subtitle_task_details(ctx: Context, task_id: str) -> di
             ctx.info(f"KlicStudio 任务 '{task_id}' 状态: progress {progress if progress is not None else '未知'}%")
             
             # 确保 subtitle_info 中的下载链接是完整的 URL
-            if "subtitle_info" in data_part and isinstance(data_part["subtitle_info"], list):
+            if data_part.get("subtitle_info") and isinstance(data_part["subtitle_info"], list):
                 for item in data_part["subtitle_info"]:
                     if "download_url" in item and isinstance(item["download_url"], str) and not item["download_url"].startswith("http"):
                         relative_url = item["download_url"]
-                        item["download_url"] = f"{KLICSTUDIO_BASE_URL.rstrip('/')}{relative_url}" if relative_url.startswith("/") else f"{KLICSTUDIO_BASE_URL.rstrip('/')}/{relative_url}"
+                        item["download_url"] = _klicstudio_url(relative_url)
             
             # 确保 speech_download_url 是完整的 URL
             if "speech_download_url" in data_part and isinstance(data_part["speech_download_url"], str) and data_part["speech_download_url"] and not data_part["speech_download_url"].startswith("http"):
                 relative_url = data_part["speech_download_url"]
-                data_part["speech_download_url"] = f"{KLICSTUDIO_BASE_URL.rstrip('/')}{relative_url}" if relative_url.startswith("/") else f"{KLICSTUDIO_BASE_URL.rstrip('/')}/{relative_url}"
+                data_part["speech_download_url"] = _klicstudio_url(relative_url)
 
             # 如果任务完成，添加嵌入字幕视频的推断下载链接
             if progress == 100:
                 if "potential_embedded_video_urls" not in data_part:
                     data_part["potential_embedded_video_urls"] = []
                 
-                # 横屏视频链接
-                h_embed_path = f"/api/file/tasks/{task_id}/output/horizontal_embed.mp4"
-                data_part["potential_embedded_video_urls"].append({
-                    "name": "嵌入字幕的横屏视频 (可能存在)",
-                    "download_url": f"{KLICSTUDIO_BASE_URL.rstrip('/')}{h_embed_path}"
-                })
-                
-                # 竖屏视频链接
-                v_embed_path = f"/api/file/tasks/{task_id}/output/vertical_embed.mp4"
-                data_part["potential_embedded_video_urls"].append({
-                    "name": "嵌入字幕的竖屏视频 (可能存在)",
-                    "download_url": f"{KLICSTUDIO_BASE_URL.rstrip('/')}{v_embed_path}"
-                })
-                ctx.info(f"为已完成的任务 {task_id} 添加了推断的嵌入视频下载链接。")
+                # 并发探测嵌入字幕视频是否存在：去掉确认不存在的链接，无法确定的仍保留并标注
+                candidates = [
+                    ("嵌入字幕的横屏视频", f"/api/file/tasks/{task_id}/output/horizontal_embed.mp4"),
+                    ("嵌入字幕的竖屏视频", f"/api/file/tasks/{task_id}/output/vertical_embed.mp4"),
+                ]
+                results = await asyncio.gather(*[_klicstudio_file_exists(path) for _, path in candidates])
+                for (name, path), exists in zip(candidates, results):
+                    if exists is False:
+                        continue
+                    data_part["potential_embedded_video_urls"].append({
+                        "name": name if exists else f"{name} (可能存在)",
+                        "download_url": _klicstudio_url(path)
+                    })
+                ctx.info(f"为已完成的任务 {task_id} 添加了 {len(data_part['potential_embedded_video_urls'])} 个嵌入视频下载链接。")
         
         return klicstudio_response
     
     except Exception as e:
         error_msg = f"获取 KlicStudio 字幕任务详情失败 (ID: {task_id}): {str(e)}"
         ctx.error(error_msg)
-        return {"error": 1, "msg": error_msg, "data": {"task_id": task_id}}
+        return KlicResponse(error=1, msg=error_msg, data={"task_id": task_id})
 
 # ===== 4. 实用工具 =====
 @mcp.tool()
@@ -436,38 +655,29 @@ async def fetch_klicstudio_file_as_text(ctx: Context, full_download_url: str) ->
         ctx.info(f"准备从 KlicStudio 下载并获取文本内容: {full_download_url}")
         
         # 这里不再需要 _klicstudio_request，因为它是完整的外部 URL
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(full_download_url)
-            response.raise_for_status()
-        
-        file_content_bytes = response.content
         # 尝试将内容解码为 UTF-8 文本，对于 SRT 等字幕文件通常是这样
         try:
-            file_text_content = file_content_bytes.decode("utf-8")
+            file_text_content, mime_type, num_bytes = await _download_text(full_download_url, "utf-8")
         except UnicodeDecodeError:
-            # 如果 UTF-8 解码失败，可以尝试其他编码或直接返回错误
+            # 已接收的数据按 UTF-8 解码失败，重新下载并按 Latin-1 解码（不会失败）
             ctx.warning(f"文件 {full_download_url} UTF-8 解码失败，尝试 Latin-1")
-            try:
-                file_text_content = file_content_bytes.decode("latin-1")
-            except UnicodeDecodeError:
-                return {"error": 1, "msg": "文件内容无法解码为文本", "data": None}
+            file_text_content, mime_type, num_bytes = await _download_text(full_download_url, "latin-1")
 
         file_name = os.path.basename(httpx.URL(full_download_url).path)
-        mime_type = response.headers.get("content-type", "text/plain")
 
-        ctx.info(f"文件 {file_name} (MIME: {mime_type}) 内容获取成功，长度: {len(file_content_bytes)} bytes.")
-        return {
-            "error": 0,
-            "msg": "文件内容获取成功",
-            "data": {
+        ctx.info(f"文件 {file_name} (MIME: {mime_type}) 内容获取成功，长度: {num_bytes} bytes.")
+        return KlicResponse(
+            error=0,
+            msg="文件内容获取成功",
+            data={
                 "file_name": file_name,
                 "text_content": file_text_content,
                 "mime_type": mime_type,
-            }
-        }
+            },
+        )
     except Exception as e:
         ctx.error(f"从 KlicStudio URL 下载文件内容失败 ({full_download_url}): {str(e)}")
-        return {"error": 1, "msg": f"下载文件内容失败: {str(e)}", "data": None}
+        return KlicResponse(error=1, msg=f"下载文件内容失败: {str(e)}")
 
 # ===== 主程序入口 =====
 if __name__ == "__main__":
@@ -482,6 +692,22 @@ if __name__ == "__main__":
         help=f"The base URL for the KlicStudio service (e.g., http://localhost:8888). "
              f"Can also be set via KLICSTUDIO_URL environment variable. Default: {DEFAULT_KLICSTUDIO_URL}"
     )
+    parser.add_argument(
+        "--klicstudio-max-parallel",
+        type=int,
+        # argparse 会对字符串默认值应用 type=int，非法的环境变量值会通过 parser.error 报告
+        default=os.getenv("KLICSTUDIO_MAX_PARALLEL", str(KLICSTUDIO_MAX_PARALLEL)),
+        help=f"Maximum number of concurrent requests sent to KlicStudio. "
+             f"Can also be set via KLICSTUDIO_MAX_PARALLEL environment variable. Default: {KLICSTUDIO_MAX_PARALLEL}"
+    )
+    parser.add_argument(
+        "--log-level",
+        type=str.upper,
+        default=os.getenv("KLICSTUDIO_LOG_LEVEL", "INFO"),
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Log level for the connector's own messages (klicstudio_mcp logger). "
+             "Can also be set via KLICSTUDIO_LOG_LEVEL environment variable. Default: INFO"
+    )
     parser.add_argument(
         "--mcp-transport",
         type=str,
@@ -504,10 +730,19 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    # FastMCP 创建时已配置根 logger 的输出，这里只调整本模块 logger 的级别
+    log.setLevel(args.log_level)
+
+    if args.klicstudio_max_parallel < 1:
+        parser.error("--klicstudio-max-parallel must be at least 1")
+
     KLICSTUDIO_BASE_URL = args.klicstudio_url.rstrip('/')
+    KLICSTUDIO_MAX_PARALLEL = args.klicstudio_max_parallel
+    _request_semaphore = asyncio.Semaphore(KLICSTUDIO_MAX_PARALLEL)
 
     print(f"KlicStudio MCP 服务器启动中...")
     print(f"  将连接到 KlicStudio 服务于: {KLICSTUDIO_BASE_URL}")
+    print(f"  最大并发请求数: {KLICSTUDIO_MAX_PARALLEL}")
     print(f"  MCP Transport 类型: {args.mcp_transport}")
     
     if args.mcp_transport == "streamable-http":
@@ -515,5 +750,24 @@ if __name__ == "__main__":
         mcp.settings.host = args.mcp_host
         mcp.settings.port = args.mcp_port
     
-    mcp.run(transport=args.mcp_transport)
+    async def _serve() -> None:
+        try:
+            if args.mcp_transport == "streamable-http":
+                await mcp.run_streamable_http_async()
+            else:
+                await mcp.run_stdio_async()
+        finally:
+            # 在同一事件循环中关闭共享连接池
+            await _close_clients()
+
+    # 可用时使用 uvloop 事件循环（不支持 Windows），否则使用默认的 asyncio 事件循环
+    run_event_loop = asyncio.run
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            run_event_loop = uvloop.run
+        except ImportError:
+            pass
+
+    run_event_loop(_serve())
  
\ No newline at end of file